@@ -3,13 +3,26 @@
 from __future__ import annotations
 
 import csv
+import heapq
+import operator
+import pickle
+import sys
 from dataclasses import dataclass
 from difflib import SequenceMatcher
 from pathlib import Path
 from typing import Iterable, List, Optional
 
+try:  # Optional: ~50-100x faster C++ scorer; difflib remains the fallback.
+    from rapidfuzz import fuzz as _rf_fuzz
+    from rapidfuzz import process as _rf_process
+except ImportError:
+    _rf_fuzz = None
+    _rf_process = None
 
-@dataclass
+_BUFFER_SIZE = 1 << 20  # 1 MiB; the default 8 KiB means far more syscalls.
+
+
+@dataclass(slots=True, frozen=True)
 class FeedbackEntry:
     name: str
     ethnicity: str
@@ -19,60 +32,169 @@ class FeedbackEntry:
 class FeedbackStore:
     """Persists verified name→ethnicity mappings that we can reuse later."""
 
+    _SIM_CACHE_SIZE = 1024
+
     def __init__(self, path: Path):
         self.path = Path(path)
-        self.entries: List[FeedbackEntry] = []
-        self._by_name: dict[str, FeedbackEntry] = {}
+        # Parallel arrays (structure-of-arrays): the similarity scan only needs
+        # _normalized_names, so the hot loop walks one contiguous list instead
+        # of chasing per-entry objects.
+        self._names: List[str] = []
+        self._ethnicities: List[str] = []
+        self._notes: List[str] = []
+        self._normalized_names: List[str] = []
+        self._by_name: dict[str, int] = {}
+        self._trigram_index: dict[str, set[int]] = {}
+        self._sim_cache: dict[tuple[str, int], List[FeedbackEntry]] = {}
         self._load()
 
+    @property
+    def entries(self) -> List[FeedbackEntry]:
+        return [self._entry_at(index) for index in range(len(self._names))]
+
+    def _entry_at(self, index: int) -> FeedbackEntry:
+        return FeedbackEntry(
+            name=self._names[index],
+            ethnicity=self._ethnicities[index],
+            notes=self._notes[index],
+        )
+
     @staticmethod
     def _normalize(name: str) -> str:
-        return name.strip().lower()
+        # casefold() folds Unicode forms (e.g. German ß) that lower() misses.
+        return name.strip().casefold()
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        if len(text) < 3:
+            return {text} if text else set()
+        return {text[i : i + 3] for i in range(len(text) - 2)}
+
+    @property
+    def _sidecar_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".pkl")
 
     def _load(self) -> None:
         if not self.path.exists():
             return
 
-        with self.path.open(newline="", encoding="utf-8") as handle:
-            reader = csv.DictReader(handle)
+        mtime = self.path.stat().st_mtime
+        if self._load_sidecar(mtime):
+            return
+
+        with self.path.open(newline="", encoding="utf-8", buffering=_BUFFER_SIZE) as handle:
+            # csv.reader with positional indices skips the per-row dict that
+            # DictReader builds, roughly halving parse time on big stores.
+            reader = csv.reader(handle)
+            header = next(reader, None)
+            if header is None or "name" not in header or "ethnicity" not in header:
+                return
+            idx_name = header.index("name")
+            idx_ethnicity = header.index("ethnicity")
+            idx_notes = header.index("notes") if "notes" in header else -1
             for row in reader:
-                name = (row.get("name") or "").strip()
-                ethnicity = (row.get("ethnicity") or "").strip()
-                notes = (row.get("notes") or "").strip()
+                if len(row) <= max(idx_name, idx_ethnicity):
+                    continue
+                name = row[idx_name].strip()
+                ethnicity = row[idx_ethnicity].strip()
+                notes = row[idx_notes].strip() if 0 <= idx_notes < len(row) else ""
                 if not name or not ethnicity:
                     continue
-                entry = FeedbackEntry(name=name, ethnicity=ethnicity, notes=notes)
-                self.entries.append(entry)
-                self._by_name[self._normalize(name)] = entry
+                self._add_entry(FeedbackEntry(name=name, ethnicity=ethnicity, notes=notes))
+
+        self._write_sidecar(mtime)
+
+    def _load_sidecar(self, mtime: float) -> bool:
+        """Restore the parsed store from the pickle sidecar if it is current."""
+        if not self._sidecar_path.exists():
+            return False
+        try:
+            with self._sidecar_path.open("rb") as handle:
+                cached_mtime, state = pickle.load(handle)
+        except (OSError, pickle.PickleError, EOFError, ValueError, TypeError):
+            return False
+        if cached_mtime != mtime:
+            return False
+        (
+            self._names,
+            self._ethnicities,
+            self._notes,
+            self._normalized_names,
+            self._by_name,
+            self._trigram_index,
+        ) = state
+        return True
+
+    def _write_sidecar(self, mtime: float) -> None:
+        state = (
+            self._names,
+            self._ethnicities,
+            self._notes,
+            self._normalized_names,
+            self._by_name,
+            self._trigram_index,
+        )
+        try:
+            with self._sidecar_path.open("wb") as handle:
+                pickle.dump((mtime, state), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass  # The sidecar is purely a cache; never fail a run over it.
+
+    def _invalidate_sidecar(self) -> None:
+        self._sidecar_path.unlink(missing_ok=True)
 
     def lookup(self, name: str) -> Optional[FeedbackEntry]:
-        return self._by_name.get(self._normalize(name))
+        index = self._by_name.get(self._normalize(name))
+        return None if index is None else self._entry_at(index)
 
     def sample(self, count: int) -> List[FeedbackEntry]:
         if count <= 0:
             return []
-        return self.entries[:count]
+        return [self._entry_at(index) for index in range(min(count, len(self._names)))]
 
     def similar_examples(self, name: str, count: int) -> List[FeedbackEntry]:
-        if count <= 0 or not name or not self.entries:
+        if count <= 0 or not name or not self._names:
             return []
 
+        query = self._normalize(name)
+        cache_key = (query, count)
+        cached = self._sim_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        results = self._score_similar(query, count)
+        if len(self._sim_cache) >= self._SIM_CACHE_SIZE:
+            self._sim_cache.pop(next(iter(self._sim_cache)))
+        self._sim_cache[cache_key] = results
+        return list(results)
+
+    def _score_similar(self, query: str, count: int) -> List[FeedbackEntry]:
+        # Candidate generation: only names sharing at least one trigram with
+        # the query can score meaningfully, so score just those. An empty
+        # candidate set falls back to the full scan.
+        candidates: set[int] = set()
+        for trigram in self._trigrams(query):
+            candidates |= self._trigram_index.get(trigram, set())
+        indices = sorted(candidates) if candidates else range(len(self._normalized_names))
+
+        if _rf_process is not None:
+            matches = _rf_process.extract(
+                query,
+                [self._normalized_names[index] for index in indices],
+                scorer=_rf_fuzz.ratio,
+                limit=count,
+                score_cutoff=1,
+            )
+            return [self._entry_at(indices[position]) for _, _, position in matches]
+
         scored = []
-        for entry in self.entries:
-            ratio = SequenceMatcher(
-                None, self._normalize(name), self._normalize(entry.name)
-            ).ratio()
-            scored.append((ratio, entry))
-
-        scored.sort(key=lambda pair: pair[0], reverse=True)
-        results: List[FeedbackEntry] = []
-        for ratio, entry in scored:
-            if ratio <= 0:
-                continue
-            results.append(entry)
-            if len(results) >= count:
-                break
-        return results
+        for index in indices:
+            ratio = SequenceMatcher(None, query, self._normalized_names[index]).ratio()
+            if ratio > 0:
+                scored.append((ratio, index))
+
+        top = heapq.nlargest(count, scored, key=operator.itemgetter(0))
+        return [self._entry_at(index) for _, index in top]
 
     def append(self, name: str, ethnicity: str, notes: str = "") -> None:
         entry = FeedbackEntry(name=name.strip(), ethnicity=ethnicity.strip(), notes=notes.strip())
@@ -80,10 +202,9 @@ class FeedbackStore:
             raise ValueError("Both name and ethnicity must be provided.")
 
         self._add_entry(entry)
-        self._persist()
+        self._append_row(entry)
 
     def extend(self, entries: Iterable[FeedbackEntry]) -> None:
-        added = False
         for entry in entries:
             if not entry.name.strip() or not entry.ethnicity.strip():
                 continue
@@ -93,23 +214,43 @@ class FeedbackStore:
                 notes=entry.notes.strip(),
             )
             self._add_entry(clean)
-            added = True
-        if added:
-            self._persist()
+            self._append_row(clean)
 
     def _add_entry(self, entry: FeedbackEntry) -> None:
-        self.entries.append(entry)
-        self._by_name[self._normalize(entry.name)] = entry
+        normalized = self._normalize(entry.name)
+        self._names.append(entry.name)
+        # The label vocabulary is tiny; interning collapses the duplicates to
+        # one string object and makes equality checks pointer comparisons.
+        self._ethnicities.append(sys.intern(entry.ethnicity))
+        self._notes.append(entry.notes)
+        self._normalized_names.append(normalized)
+        index = len(self._names) - 1
+        self._by_name[normalized] = index
+        for trigram in self._trigrams(normalized):
+            self._trigram_index.setdefault(trigram, set()).add(index)
+        self._sim_cache.clear()
+
+    def _append_row(self, entry: FeedbackEntry) -> None:
+        """Append one entry without rewriting the whole file."""
+        self._invalidate_sidecar()
+        write_header = not self.path.exists() or self.path.stat().st_size == 0
+        with self.path.open("a", newline="", encoding="utf-8") as handle:
+            writer = csv.DictWriter(handle, fieldnames=["name", "ethnicity", "notes"])
+            if write_header:
+                writer.writeheader()
+            writer.writerow(
+                {
+                    "name": entry.name,
+                    "ethnicity": entry.ethnicity,
+                    "notes": entry.notes,
+                }
+            )
 
-    def _persist(self) -> None:
-        with self.path.open("w", newline="", encoding="utf-8") as handle:
+    def _persist_all(self) -> None:
+        """Full rewrite; kept for compaction/dedup paths."""
+        self._invalidate_sidecar()
+        with self.path.open("w", newline="", encoding="utf-8", buffering=_BUFFER_SIZE) as handle:
             writer = csv.DictWriter(handle, fieldnames=["name", "ethnicity", "notes"])
             writer.writeheader()
-            for entry in self.entries:
-                writer.writerow(
-                    {
-                        "name": entry.name,
-                        "ethnicity": entry.ethnicity,
-                        "notes": entry.notes,
-                    }
-                )
+            for name, ethnicity, notes in zip(self._names, self._ethnicities, self._notes):
+                writer.writerow({"name": name, "ethnicity": ethnicity, "notes": notes})
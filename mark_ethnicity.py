@@ -9,20 +9,24 @@ Environment:
   OPENAI_API_KEY   (required) - set via environment or .env file alongside this script.
   OPENAI_MODEL     (optional) - defaults to gpt-4o-mini.
   OPENAI_CA_BUNDLE (optional) - path to CA bundle for TLS verification.
+  OPENAI_MAX_RPM   (optional) - client-side requests-per-minute budget (defaults to 3500).
 """
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
 import csv
+import functools
+import http.client
 import json
 import os
+import random
 import ssl
 import sys
+import threading
 import time
-import urllib.error
-import urllib.request
 from pathlib import Path
-from typing import Iterable, List, Sequence
+from typing import Iterable, Iterator, List, Sequence
 
 from feedback_store import FeedbackEntry, FeedbackStore
 
@@ -35,7 +39,51 @@ DEFAULT_PROMPT = (
     "'African', 'European', 'Latino', 'Mixed', or 'Unknown'). "
     "Use 'Unknown' if the ethnicity cannot be determined confidently from the name alone."
 )
-API_URL = "https://api.openai.com/v1/chat/completions"
+API_HOST = "api.openai.com"
+API_PATH = "/v1/chat/completions"
+MAX_CONCURRENT_REQUESTS = 20
+DEFAULT_MAX_RPM = 3500
+BATCH_SIZE = 20
+WINDOW_SIZE = MAX_CONCURRENT_REQUESTS * BATCH_SIZE
+CSV_BUFFER_SIZE = 1 << 20  # 1 MiB; the default 8 KiB means far more syscalls.
+BATCH_INSTRUCTION = (
+    "You will receive a numbered list of names. Reply with a JSON array of "
+    "labels, one per name, in the same order. Output only the JSON array."
+)
+
+
+class RateLimiter:
+    """Token bucket that paces requests to a requests-per-minute budget."""
+
+    def __init__(self, max_rpm: int):
+        self.capacity = max(1, max_rpm)
+        self.rate = self.capacity / 60.0
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def build_rate_limiter() -> RateLimiter:
+    try:
+        max_rpm = int(os.environ.get("OPENAI_MAX_RPM", DEFAULT_MAX_RPM))
+    except ValueError:
+        max_rpm = DEFAULT_MAX_RPM
+    return RateLimiter(max_rpm)
 
 
 def load_env() -> None:
@@ -59,119 +107,266 @@ def build_ssl_context() -> ssl.SSLContext:
     return ssl.create_default_context()
 
 
+@functools.lru_cache(maxsize=512)
+def _render_prompt(base_prompt: str, examples: tuple[tuple[str, str, str], ...]) -> str:
+    body = "\n".join(
+        f"- {name} -> {ethnicity}" + (f" ({notes})" if notes else "")
+        for name, ethnicity, notes in examples
+    )
+    return f"{base_prompt}\n\nPreviously approved mappings:\n{body}"
+
+
 def build_prompt(base_prompt: str, examples: Sequence[FeedbackEntry]) -> str:
     if not examples:
         return base_prompt
+    # Similar names often pull the same few-shot block, so memoize the join.
+    return _render_prompt(
+        base_prompt, tuple((e.name, e.ethnicity, e.notes) for e in examples)
+    )
+
+
+def retry_delay(status: int, retry_after: str | None, attempt: int) -> float:
+    if status == 429 and retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Exponential backoff with jitter so concurrent retries don't stampede.
+    return 2 ** attempt + random.uniform(0, 1)
+
+
+_connections = threading.local()
+
 
-    lines = [base_prompt, "", "Previously approved mappings:"]
-    for entry in examples:
-        note_segment = f" ({entry.notes})" if entry.notes else ""
-        lines.append(f"- {entry.name} -> {entry.ethnicity}{note_segment}")
-    return "\n".join(lines)
-
-
-def call_openai(name: str, prompt: str, model: str, context: ssl.SSLContext) -> str:
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"Name: {name}"},
-        ],
-        "temperature": 0,
+def _get_connection(context: ssl.SSLContext) -> http.client.HTTPSConnection:
+    """Return this thread's keep-alive connection, creating it on first use."""
+    connection = getattr(_connections, "api", None)
+    if connection is None:
+        connection = http.client.HTTPSConnection(API_HOST, timeout=60, context=context)
+        _connections.api = connection
+    return connection
+
+
+def _drop_connection() -> None:
+    connection = getattr(_connections, "api", None)
+    if connection is not None:
+        connection.close()
+        _connections.api = None
+
+
+def request_completion(
+    messages: List[dict],
+    model: str,
+    context: ssl.SSLContext,
+    limiter: RateLimiter | None = None,
+) -> str:
+    body = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": 0,
+        }
+    ).encode("utf-8")
+    headers = {
+        "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}",
+        "Content-Type": "application/json",
     }
-    request = urllib.request.Request(
-        API_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
-    )
 
     max_attempts = 3
     for attempt in range(1, max_attempts + 1):
+        if limiter is not None:
+            limiter.acquire()
+        connection = _get_connection(context)
         try:
-            with urllib.request.urlopen(request, context=context) as response:
-                data = json.load(response)
-            return data["choices"][0]["message"]["content"].strip()
-        except urllib.error.HTTPError as exc:
-            body = exc.read().decode("utf-8", "ignore")
-            if exc.code in {429, 500, 502, 503, 504} and attempt < max_attempts:
-                time.sleep(2 * attempt)
-                continue
-            raise RuntimeError(f"HTTP error {exc.code}: {body}") from exc
-        except urllib.error.URLError as exc:
+            connection.request("POST", API_PATH, body=body, headers=headers)
+            response = connection.getresponse()
+            status = response.status
+            retry_after = response.getheader("Retry-After")
+            raw = response.read()  # Fully drain so the connection can be reused.
+        except (http.client.HTTPException, OSError) as exc:
+            _drop_connection()
             if attempt < max_attempts:
-                time.sleep(2 * attempt)
+                time.sleep(2 ** attempt + random.uniform(0, 1))
                 continue
-            raise RuntimeError(f"Network error: {exc.reason}") from exc
-        except (KeyError, IndexError) as exc:
-            raise RuntimeError(f"Unexpected response: {json.dumps(data, indent=2)}") from exc
-
-
-def insert_ethnicity(row: List[str], ethnicity: str) -> List[str]:
-    new_row = list(row)
-    new_row.insert(1, ethnicity)
-    return new_row
+            raise RuntimeError(f"Network error: {exc}") from exc
+
+        if status == 200:
+            data = json.loads(raw)
+            try:
+                return data["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError) as exc:
+                raise RuntimeError(
+                    f"Unexpected response: {json.dumps(data, indent=2)}"
+                ) from exc
+
+        text = raw.decode("utf-8", "ignore")
+        if status in {429, 500, 502, 503, 504} and attempt < max_attempts:
+            time.sleep(retry_delay(status, retry_after, attempt))
+            continue
+        raise RuntimeError(f"HTTP error {status}: {text}")
 
 
-def read_csv(path: Path) -> List[List[str]]:
-    with path.open(newline="", encoding="utf-8") as handle:
-        return [row for row in csv.reader(handle)]
+def call_openai(
+    name: str,
+    prompt: str,
+    model: str,
+    context: ssl.SSLContext,
+    limiter: RateLimiter | None = None,
+) -> str:
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": f"Name: {name}"},
+    ]
+    return request_completion(messages, model, context, limiter)
+
+
+def call_openai_batch(
+    names: List[str],
+    prompt: str,
+    model: str,
+    context: ssl.SSLContext,
+    limiter: RateLimiter | None = None,
+) -> List[str]:
+    """Classify several names in one request; returns labels in input order."""
+    numbered = "\n".join(f"{i}. {name}" for i, name in enumerate(names, start=1))
+    messages = [
+        {"role": "system", "content": f"{prompt}\n\n{BATCH_INSTRUCTION}"},
+        {"role": "user", "content": f"Names:\n{numbered}"},
+    ]
+    content = request_completion(messages, model, context, limiter)
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+    try:
+        labels = json.loads(content)
+    except json.JSONDecodeError as exc:
+        raise RuntimeError(f"Expected a JSON array of labels, got: {content}") from exc
+    if not isinstance(labels, list) or len(labels) != len(names):
+        raise RuntimeError(
+            f"Expected {len(names)} labels, got: {content}"
+        )
+    return [str(label).strip() for label in labels]
 
 
-def write_csv(path: Path, rows: Iterable[List[str]]) -> None:
-    with path.open("w", newline="", encoding="utf-8") as handle:
-        writer = csv.writer(handle)
-        for row in rows:
-            writer.writerow(row)
+def insert_ethnicity(row: List[str], ethnicity: str) -> List[str]:
+    # Build the row in one pass; copy-then-insert shifts every later column.
+    return [row[0], ethnicity, *row[1:]] if row else [ethnicity]
 
 
-def process_rows(
-    rows: List[List[str]],
+def annotate_window(
+    window: List[List[str]],
     prompt: str,
     model: str,
     limit: int | None,
-    has_header: bool,
     store: FeedbackStore,
     fewshot_count: int,
     force_api: bool,
+    context: ssl.SSLContext,
+    limiter: RateLimiter,
 ) -> List[List[str]]:
-    context = build_ssl_context()
-    start_index = 1 if (has_header and rows) else 0
-    output_rows: List[List[str]] = []
-
-    if has_header and rows:
-        header = list(rows[0])
-        header.insert(1, "Ethnicity")
-        output_rows.append(header)
-
+    # First pass: resolve what we can locally and queue the rest for the API.
+    # Duplicate names (common in signup exports) are classified once and the
+    # label broadcast to every row that carries them.
+    labels: dict[int, str] = {}
+    pending: dict[str, tuple[str, List[int]]] = {}  # name -> (prompt, row indices)
+    # The sample() fallback is constant for the run; build it once, not per row.
+    fallback_prompt = build_prompt(prompt, store.sample(fewshot_count))
     processed = 0
-    for idx, row in enumerate(rows[start_index:], start=start_index):
+    for idx, row in enumerate(window):
         if limit is not None and processed >= limit:
             # Preserve row but leave ethnicity blank for unprocessed entries.
-            output_rows.append(insert_ethnicity(row, ""))
+            labels[idx] = ""
             continue
 
         name = row[0].strip() if row else ""
         if not name:
-            label = "Unknown"
+            labels[idx] = "Unknown"
         else:
             cached = None if force_api else store.lookup(name)
             if cached:
-                label = cached.ethnicity
+                labels[idx] = cached.ethnicity
+            elif name in pending:
+                pending[name][1].append(idx)
             else:
-                examples = store.similar_examples(name, fewshot_count) or store.sample(fewshot_count)
-                label = call_openai(name, build_prompt(prompt, examples), model, context)
-
-        output_rows.append(insert_ethnicity(row, label))
+                examples = store.similar_examples(name, fewshot_count)
+                row_prompt = build_prompt(prompt, examples) if examples else fallback_prompt
+                pending[name] = (row_prompt, [idx])
         processed += 1
 
-    if not has_header:
-        return output_rows
+    # Names that share a prompt (common when the few-shot examples repeat) are
+    # packed into one request, so the prompt tokens are sent once per batch
+    # instead of once per name.
+    by_prompt: dict[str, List[str]] = {}
+    for name, (row_prompt, _) in pending.items():
+        by_prompt.setdefault(row_prompt, []).append(name)
+    batches: List[tuple[str, List[str]]] = []
+    for row_prompt, names in by_prompt.items():
+        for offset in range(0, len(names), BATCH_SIZE):
+            batches.append((row_prompt, names[offset : offset + BATCH_SIZE]))
+
+    # Fan the API calls out across a bounded pool; each call is IO-bound on
+    # HTTPS latency, so concurrency cuts wall-clock time roughly by the pool size.
+    if batches:
+
+        def classify_batch(row_prompt: str, names: List[str]) -> List[str]:
+            if len(names) == 1:
+                return [call_openai(names[0], row_prompt, model, context, limiter)]
+            return call_openai_batch(names, row_prompt, model, context, limiter)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_CONCURRENT_REQUESTS, len(batches))
+        ) as executor:
+            futures = {
+                executor.submit(classify_batch, row_prompt, names): names
+                for row_prompt, names in batches
+            }
+            for future in concurrent.futures.as_completed(futures):
+                for name, label in zip(futures[future], future.result()):
+                    for idx in pending[name][1]:
+                        labels[idx] = label
+
+    return [insert_ethnicity(row, labels[idx]) for idx, row in enumerate(window)]
 
-    return output_rows
+
+def process_rows(
+    rows: Iterable[List[str]],
+    prompt: str,
+    model: str,
+    limit: int | None,
+    has_header: bool,
+    store: FeedbackStore,
+    fewshot_count: int,
+    force_api: bool,
+) -> Iterator[List[str]]:
+    """Stream annotated rows; only one window of rows is held in memory."""
+    context = build_ssl_context()
+    limiter = build_rate_limiter()
+    iterator = iter(rows)
+
+    if has_header:
+        header = next(iterator, None)
+        if header is None:
+            return
+        header = list(header)
+        header.insert(1, "Ethnicity")
+        yield header
+
+    remaining = limit
+    window: List[List[str]] = []
+    for row in iterator:
+        window.append(row)
+        if len(window) >= WINDOW_SIZE:
+            yield from annotate_window(
+                window, prompt, model, remaining, store, fewshot_count,
+                force_api, context, limiter,
+            )
+            if remaining is not None:
+                remaining = max(0, remaining - len(window))
+            window = []
+    if window:
+        yield from annotate_window(
+            window, prompt, model, remaining, store, fewshot_count,
+            force_api, context, limiter,
+        )
 
 
 def derive_output_path(input_path: Path, explicit: str | None) -> Path:
@@ -252,31 +447,31 @@ def main() -> int:
         print(f"Input CSV not found: {input_path}", file=sys.stderr)
         return 1
 
-    try:
-        rows = read_csv(input_path)
-    except Exception as exc:  # noqa: BLE001
-        print(f"Failed to read CSV: {exc}", file=sys.stderr)
-        return 1
-
     output_path = derive_output_path(input_path, args.output_csv)
     feedback_store = FeedbackStore(Path(args.feedback_store).expanduser())
 
+    # Stream reader -> classifier -> writer so only one window of rows is
+    # ever held in memory.
     try:
-        annotated = process_rows(
-            rows,
-            prompt=prompt,
-            model=model,
-            limit=args.limit,
-            has_header=not args.no_header,
-            store=feedback_store,
-            fewshot_count=max(0, args.fewshot_count),
-            force_api=args.force_api,
-        )
+        with input_path.open(newline="", encoding="utf-8", buffering=CSV_BUFFER_SIZE) as infile, \
+                output_path.open("w", newline="", encoding="utf-8", buffering=CSV_BUFFER_SIZE) as outfile:
+            writer = csv.writer(outfile)
+            writer.writerows(
+                process_rows(
+                    csv.reader(infile),
+                    prompt=prompt,
+                    model=model,
+                    limit=args.limit,
+                    has_header=not args.no_header,
+                    store=feedback_store,
+                    fewshot_count=max(0, args.fewshot_count),
+                    force_api=args.force_api,
+                )
+            )
     except Exception as exc:  # noqa: BLE001
         print(f"Failed to classify names: {exc}", file=sys.stderr)
         return 1
 
-    write_csv(output_path, annotated)
     print(f"Wrote annotated CSV to {output_path}")
     return 0
 
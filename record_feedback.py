@@ -38,13 +38,19 @@ def parse_args() -> argparse.Namespace:
 def import_csv(path: Path) -> list[FeedbackEntry]:
     entries: list[FeedbackEntry] = []
     with path.open(newline="", encoding="utf-8") as handle:
-        reader = csv.DictReader(handle)
-        if "name" not in reader.fieldnames or "ethnicity" not in reader.fieldnames:
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if header is None or "name" not in header or "ethnicity" not in header:
             raise ValueError("CSV must include 'name' and 'ethnicity' columns.")
+        idx_name = header.index("name")
+        idx_ethnicity = header.index("ethnicity")
+        idx_notes = header.index("notes") if "notes" in header else -1
         for row in reader:
-            name = (row.get("name") or "").strip()
-            ethnicity = (row.get("ethnicity") or "").strip()
-            notes = (row.get("notes") or "").strip()
+            if len(row) <= max(idx_name, idx_ethnicity):
+                continue
+            name = row[idx_name].strip()
+            ethnicity = row[idx_ethnicity].strip()
+            notes = row[idx_notes].strip() if 0 <= idx_notes < len(row) else ""
             if not name or not ethnicity:
                 continue
             entries.append(FeedbackEntry(name=name, ethnicity=ethnicity, notes=notes))